@@ -7,6 +7,7 @@ from app import app
 from flower import main
 
 app.flower_db = main.get_flowerpedia_db()
+app.reach_db = main.get_reach_db(app.flower_db)
 
 
 @app.route("/", methods=["GET"])
@@ -44,35 +45,44 @@ def result_page():
         tgt, key=lambda x: flowerpedia[x].total_prob if x in flowerpedia else -math.inf
     )
 
-    path = main.ancestors(best_flower, flowerpedia)
-
-    res, name = main.stepify(best_flower, path)
+    plan = main.extract_plan(best_flower, flowerpedia)
+    res, name = plan.steps, plan.names
     # base flowers in result / steps
-    base_flowers_needed = [f for f, a, p, t in res if len(a) == 0]
+    base_flowers_needed = [s.flower for s in res if len(s.parents) == 0]
     # base flowers appearing in tests
     base_flowers_needed.extend(
-        test_f 
-        for *_, t in res
-        if t
-        and (test_f := main.Flower(tgt_type, main.read_code(t["test_flower_code"]))) not in base_flowers_needed
-        and test_f not in (f for f, a, *_ in res if len(a) > 0)
+        test_f
+        for s in res
+        if s.test
+        and (test_f := s.test.test_flower) not in base_flowers_needed
+        and test_f not in (s.flower for s in res if len(s.parents) > 0)
     )
 
     tn = 0
     hybrid_flowers = [
         (
-            f,
-            (a if len(a) == 2 else (a[0], a[0])),
-            f"{float(p) * 100:0.2f}",
-            t,
-            (tn := tn + 1 if t else 0),
+            s.flower,
+            (s.parents if len(s.parents) == 2 else (s.parents[0], s.parents[0])),
+            f"{s.prob * 100:0.2f}",
+            s.test,
+            (tn := tn + 1 if s.test else 0),
         )
-        for f, a, p, t in res
-        if len(a) > 0
+        for s in res
+        if len(s.parents) > 0
     ]
 
-    test_keys = "unknown_flower_code unknown_flower_color test_flower_code test_flower_color test_prob test_color".split()
-    tests = [[t[k] for k in test_keys] for *_, t in res if t]
+    tests = [
+        [
+            s.test.unknown_flower.code,
+            s.test.unknown_flower.color,
+            s.test.test_flower.code,
+            s.test.test_flower.color,
+            s.test.test_prob,
+            s.test.test_color,
+        ]
+        for s in res
+        if s.test
+    ]
 
     return render_template(
         "results.html",
@@ -80,7 +90,7 @@ def result_page():
         hybrid_flowers=hybrid_flowers,
         names=name,
         tests=tests,
-        graph=path,
+        graph=plan.tree(),
         len=len,
         enumerate=enumerate,
     )
@@ -101,4 +111,19 @@ def request_compatible_colors():
         return json.dumps({f"{tgt}s": possible})
     
     else:
-        return json.dumps({f"{tgt}s": []})
\ No newline at end of file
+        return json.dumps({f"{tgt}s": []})
+
+
+@app.route("/reachability", methods=["POST"])
+def request_reachable_colors():
+    form = request.form
+
+    flower_type = getattr(main.Flower, form["flower_type"], None)
+    seed = form.get("seed") == "true"
+    island = form.get("island") == "true"
+    if flower_type in main.Flower.flowertypes:
+        colors = app.reach_db[flower_type].colors(seed, island)
+        return json.dumps({"colors": {c: p for c, p in sorted(colors.items())}})
+
+    else:
+        return json.dumps({"colors": {}})
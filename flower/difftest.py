@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""
+Differential testing of explore engines.
+
+Runs an alternative engine against the reference `explore`, both in deterministic mode,
+for every flower type and base flowers configuration, and reports mismatches of total
+probability, parents and tests.
+
+Usage (from repository root):
+
+    python -m flower.difftest parallel spill parallel-spill
+    python -m flower.difftest my_module:my_explore --rel-tol 1e-9
+"""
+
+
+import argparse
+import importlib
+import math
+import sys
+import tempfile
+
+from dataclasses import dataclass
+from os import path
+from typing import *
+
+from flower import main
+from flower.main import AncestorInfo, Flower, FlowerPedia, FlowerType
+
+# An engine computes a FlowerPedia (any Mapping) from base flowers.
+Engine = Callable[[List[Flower]], Mapping[Flower, AncestorInfo]]
+
+
+def reference_engine(base_flowers: List[Flower]) -> FlowerPedia:
+    return main.explore(base_flowers, deterministic=True)
+
+
+def parallel_engine(base_flowers: List[Flower]) -> FlowerPedia:
+    return main.explore(base_flowers, jobs=2, deterministic=True)
+
+
+def spill_engine(base_flowers: List[Flower], jobs: Optional[int] = None) -> FlowerPedia:
+    with tempfile.TemporaryDirectory() as tmp:
+        # Small enough for records to go back and forth to disk.
+        store = main.SpillStore(path.join(tmp, "flowerpedia"), max_records=8)
+        main.explore(base_flowers, jobs=jobs, store=store, deterministic=True)
+        flowerpedia = FlowerPedia(dict(store))
+        store.close()
+    return flowerpedia
+
+
+def parallel_spill_engine(base_flowers: List[Flower]) -> FlowerPedia:
+    return spill_engine(base_flowers, jobs=2)
+
+
+engines: Dict[str, Engine] = {
+    "reference": reference_engine,
+    "parallel": parallel_engine,
+    "spill": spill_engine,
+    "parallel-spill": parallel_spill_engine,
+}
+
+
+def load_engine(name: str) -> Engine:
+    """
+    A registered engine name, or `module:function`.
+    """
+    if name in engines:
+        return engines[name]
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+@dataclass
+class Mismatch:
+    key: Tuple[FlowerType, bool, bool]
+    flower: Flower
+    field: str
+    expected: Any
+    got: Any
+
+    def __str__(self) -> str:
+        return f"{self.key} {self.flower.code}: {self.field} expected {self.expected}, got {self.got}"
+
+
+def compare(
+    key: Tuple[FlowerType, bool, bool],
+    expected: Mapping[Flower, AncestorInfo],
+    got: Mapping[Flower, AncestorInfo],
+    rel_tol: float = 1e-9,
+) -> List[Mismatch]:
+    res = []
+
+    for f in sorted(set(expected) | set(got)):
+        if f not in got:
+            res.append(Mismatch(key, f, "flower", "reachable", "missing"))
+            continue
+        if f not in expected:
+            res.append(Mismatch(key, f, "flower", "missing", "reachable"))
+            continue
+
+        e, g = expected[f], got[f]
+        if not math.isclose(e.total_prob, g.total_prob, rel_tol=rel_tol):
+            res.append(Mismatch(key, f, "total_prob", e.total_prob, g.total_prob))
+        if e.parents != g.parents:
+            res.append(Mismatch(key, f, "parents", e.parents, g.parents))
+        if (e.test.test_flower, e.test.test_color) != (g.test.test_flower, g.test.test_color):
+            res.append(
+                Mismatch(
+                    key,
+                    f,
+                    "test",
+                    (e.test.test_flower, e.test.test_color),
+                    (g.test.test_flower, g.test.test_color),
+                )
+            )
+        elif not math.isclose(e.test.test_prob, g.test.test_prob, rel_tol=rel_tol):
+            res.append(Mismatch(key, f, "test_prob", e.test.test_prob, g.test.test_prob))
+
+    return res
+
+
+def difftest(
+    engines: Dict[str, Engine],
+    reference: Engine = reference_engine,
+    keys: Optional[List[Tuple[FlowerType, bool, bool]]] = None,
+    rel_tol: float = 1e-9,
+) -> Dict[str, List[Mismatch]]:
+    """
+    Mismatches of each engine of `engines` against `reference` for every configuration in
+    `keys` (all types, seed and island configurations by default).
+    The reference is computed once per configuration.
+    """
+    res: Dict[str, List[Mismatch]] = {name: [] for name in engines}
+    for key in keys or main.flowerpedia_keys:
+        base_flowers = main.base_flowers_of(*key)
+        expected = reference(base_flowers)
+        for name, engine in engines.items():
+            res[name] += compare(key, expected, engine(base_flowers), rel_tol)
+    return res
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "engines",
+        nargs="+",
+        help=f"Engines to test: {', '.join(engines)} or module:function",
+    )
+    parser.add_argument(
+        "-t",
+        "--type",
+        type=(lambda x: getattr(Flower, x.upper())),
+        choices=Flower.flowertypes,
+        action="append",
+        help="Only test these flower types",
+    )
+    parser.add_argument("--rel-tol", type=float, default=1e-9, help="Relative tolerance on probabilities")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = cli()
+    keys = [k for k in main.flowerpedia_keys if args.type is None or k[0] in args.type]
+
+    results = difftest({name: load_engine(name) for name in args.engines}, keys=keys, rel_tol=args.rel_tol)
+
+    for name, mismatches in results.items():
+        for m in mismatches:
+            print(f"[{name}] {m}")
+        print(f"[{name}] {len(mismatches)} mismatches over {len(keys)} configurations")
+
+    sys.exit(1 if any(results.values()) else 0)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+Precomputes best plans of every reachable flower and exports them as static JSON shards.
+
+One shard per (type, seed, island) configuration, e.g. `export/roses-seed-island.json`.
+A manifest records a fingerprint of the species data each shard was computed from,
+so that only shards whose data changed are exported again.
+
+Usage (from repository root):
+
+    python -m flower.export --out export --jobs 4
+"""
+
+
+import argparse
+import hashlib
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from typing import *
+
+from flower import main
+from flower.main import Flower, FlowerType, Plan
+
+# Bump when the layout of exported shards changes, forces a full export.
+EXPORT_VERSION = 3
+
+MANIFEST = "manifest.json"
+
+ShardKey = Tuple[FlowerType, bool, bool]
+
+
+def csv_file_of(flower_type: FlowerType) -> str:
+    return path.join("data", Flower.species[flower_type].file)
+
+
+def shard_name(key: ShardKey) -> str:
+    flower_type, seed, island = key
+    parts = [flower_type.strip("_").lower()]
+    if seed:
+        parts.append("seed")
+    if island:
+        parts.append("island")
+    return "-".join(parts) + ".json"
+
+
+def fingerprint(key: ShardKey) -> str:
+    """
+    Identifies data used to compute a shard: species definition and content of its csv file.
+    """
+    h = hashlib.sha1(f"{EXPORT_VERSION} {Flower.species[key[0]]}".encode())
+    with open(csv_file_of(key[0]), "rb") as fp:
+        h.update(fp.read())
+    return h.hexdigest()
+
+
+def plan_record(plan: Plan) -> Dict[str, Any]:
+    """
+    JSON friendly version of a plan, flowers are referred to by their code.
+    """
+    return {
+        "total_prob": plan.steps[-1].total_prob,
+        "names": plan.names,
+        "steps": [
+            {
+                "code": s.flower.code,
+                "color": s.flower.color,
+                "parents": [f.code for f in s.parents],
+                "prob": s.prob,
+                "total_prob": s.total_prob,
+                "test": {
+                    "unknown_flower_code": s.test.unknown_flower.code,
+                    "unknown_flower_color": s.test.unknown_flower.color,
+                    "test_flower_code": s.test.test_flower.code,
+                    "test_flower_color": s.test.test_flower.color,
+                    "test_prob": s.test.test_prob,
+                    "test_color": s.test.test_color,
+                } if s.test else None,
+            }
+            for s in plan.steps
+        ],
+    }
+
+
+def shard_record(key: ShardKey, flowerpedia: main.FlowerPedia) -> Dict[str, Any]:
+    flower_type, seed, island = key
+
+    flowers = {f.code: plan_record(main.extract_plan(f, flowerpedia)) for f in sorted(flowerpedia)}
+
+    # Best flower for each color, as served by the results page.
+    colors = {}
+    for color in Flower.flowercolors:
+        tgt = [f for f in main.uget(main.flower_info, _type=flower_type, _color=color) if f in flowerpedia]
+        if tgt:
+            best = max(tgt, key=lambda x: flowerpedia[x].total_prob)
+            colors[color] = best.code
+
+    return {
+        "type": flower_type,
+        "seed": seed,
+        "island": island,
+        "colors": colors,
+        "flowers": flowers,
+    }
+
+
+def write_json(file: str, obj: Any):
+    """
+    Atomic write, readers never see a partially written file.
+    """
+    tmp = f"{file}.tmp"
+    with open(tmp, "w") as fp:
+        json.dump(obj, fp, separators=(",", ":"), sort_keys=True)
+    os.replace(tmp, file)
+
+
+def export_shard(key: ShardKey, out_dir: str) -> Tuple[ShardKey, str]:
+    """
+    Computes and writes one shard. Runs in a worker process.
+    Deterministic mode makes shards the same whatever the run that exported them.
+    """
+    digest = fingerprint(key)
+    flowerpedia = main.explore(main.base_flowers_of(*key), deterministic=True)
+    write_json(path.join(out_dir, shard_name(key)), shard_record(key, flowerpedia))
+    return key, digest
+
+
+def load_manifest(out_dir: str) -> Dict[str, str]:
+    file = path.join(out_dir, MANIFEST)
+    if not path.isfile(file):
+        return {}
+    with open(file, "r") as fp:
+        return json.load(fp)
+
+
+def stale_shards(out_dir: str, force: bool = False) -> List[ShardKey]:
+    """
+    Shards whose csv data changed since last export, or that are missing.
+    """
+    manifest = load_manifest(out_dir)
+    return [
+        key
+        for key in main.flowerpedia_keys
+        if force
+        or manifest.get(shard_name(key)) != fingerprint(key)
+        or not path.isfile(path.join(out_dir, shard_name(key)))
+    ]
+
+
+def export(out_dir: str, jobs: Optional[int] = None, force: bool = False) -> List[ShardKey]:
+    """
+    Exports every stale shard in parallel then updates the manifest.
+    Returns exported shards.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    todo = stale_shards(out_dir, force)
+
+    manifest = load_manifest(out_dir)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for key, digest in executor.map(export_shard, todo, [out_dir] * len(todo)):
+            print(f"Exported {shard_name(key)}")
+            manifest[shard_name(key)] = digest
+
+    write_json(path.join(out_dir, MANIFEST), manifest)
+    return todo
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-o", "--out", default="export", help="Output directory of shards")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes")
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Export all shards, even those whose data did not change",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = cli()
+    exported = export(args.out, args.jobs, args.force)
+    print(f"{len(exported)}/{len(main.flowerpedia_keys)} shards exported to {args.out}")
@@ -10,13 +10,20 @@ mail:   douzont@gmail.com
 
 
 import argparse
+import array
+import dbm.dumb
 import itertools as it
 import json
 import math
+import multiprocessing
 import pickle
+import shelve
+import sys
 import warnings
 
-from collections import deque, namedtuple, Counter
+from collections import deque, namedtuple, Counter, OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from functools import reduce, lru_cache
 from pprint import pprint
@@ -24,6 +31,11 @@ from operator import mul
 from os import path
 from typing import *
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
 # This code uses informations provided by this source: https://docs.google.com/document/d/1ARIQCUc5YVEd01D7jtJT9EEJF45m07NXhAm4fOpNvCs/mobilebasic
 # All flowers rules are explained deeply an thoroughly inside.
 
@@ -46,10 +58,11 @@ mix_d = {
 }
 
 
-@lru_cache(maxsize=81 ** 2 + 27 ** 2)
+@lru_cache(maxsize=None)
 def mix_flowers(f1, f2):
     """
     Memoized flower hybridation for speedup. Equivalent to a lookup table.
+    Works for any number of genes N, the table holds at most (3^N)^2 entries per species.
     Do not use as is, use Flower's addition to combine Flowers.
     """
     res_genes = (mix_d[g] for g in zip(f1, f2))
@@ -63,29 +76,33 @@ def mix_flowers(f1, f2):
     return res
 
 
+@dataclass
+class Species:
+    flower_type: FlowerType
+    file: str
+    genes: List[str]  # Gene letters, e.g. ["r", "y", "w", "s"]
+    inverted: List[str]  # Genes where 0 is dominant over 2, e.g. ["w"]
+    supported: bool = True  # False when gene data is missing in csv file (violets)
+
+    @property
+    def n_genes(self) -> int:
+        return len(self.genes)
+
+    def gene_names(self, i: int) -> List[str]:
+        """
+        Names of gene `i` for values 0, 1 and 2.
+        """
+        g = self.genes[i]
+        names = [g.lower() * 2, g.upper() + g.lower(), g.upper() * 2]
+        if g in self.inverted:
+            names.reverse()
+        return names
+
+
 class Flower:
 
-    COSMOS = FlowerType("__COSMOS__")
-    HYACINTHS = FlowerType("__HYACINTHS__")
-    LILIES = FlowerType("__LILIES__")
-    MUMS = FlowerType("__MUMS__")
-    PANSIES = FlowerType("__PANSIES__")
-    ROSES = FlowerType("__ROSES__")
-    TULIPS = FlowerType("__TULIPS__")
-    VIOLETS = FlowerType("__VIOLETS__")
-    WINDFLOWERS = FlowerType("__WINDFLOWERS__")
-
-    flowertypes = [
-        COSMOS,
-        HYACINTHS,
-        LILIES,
-        MUMS,
-        PANSIES,
-        ROSES,
-        TULIPS,
-        VIOLETS,
-        WINDFLOWERS,
-    ]
+    # Flower types (e.g. `Flower.ROSES`) are registered from `data/species.json` by `load_species`.
+    flowertypes: List[FlowerType] = []
 
     BLACK = FlowerColor("Black")
     BLUE = FlowerColor("Blue")
@@ -99,27 +116,18 @@ class Flower:
 
     flowercolors = [BLACK, BLUE, GREEN, PINK, PURPLE, ORANGE, RED, YELLOW, WHITE]
 
-    # r y o w s
-    flower_unused_gene: Dict[FlowerType, List[int]] = {
-        COSMOS: [-3, -2],
-        HYACINTHS: [-3, -1],
-        LILIES: [-3, -2],
-        MUMS: [-3, -1],
-        PANSIES: [-3, -1],
-        ROSES: [-3],
-        TULIPS: [-3, -2],
-        VIOLETS: [-3, -1],
-        WINDFLOWERS: [-4, -1],
-    }
+    # Gene layout of each flower type, loaded from `data/species.json`.
+    species: Dict[FlowerType, Species] = {}
 
     def __init__(self, flower_type: FlowerType, genes: Sequence[int]):
         """
         Create a Flower based on its genes.
-        Genes are represented by a sequence of 3 or 4 integers 0⩽x_i⩽2
+        Genes are represented by a sequence of N integers 0⩽x_i⩽2, N given by the species.
         """
-        if flower_type == Flower.VIOLETS:
+        if not Flower.species[flower_type].supported:
             warnings.warn(f"Flower type {flower_type} is not supported, gene data is missing in csv file.")
-        assert len(genes) == 5 - len(Flower.flower_unused_gene[flower_type]), f"Expected genes length of {5 - len(Flower.flower_unused_gene[flower_type])}, got {len(genes)} instead."
+        n_genes = Flower.species[flower_type].n_genes
+        assert len(genes) == n_genes, f"Expected genes length of {n_genes}, got {len(genes)} instead."
         
         self.type = flower_type
         self.genes = tuple(genes)
@@ -140,23 +148,8 @@ class Flower:
 
     @property
     def code(self) -> str:
-        gene_name = [
-            "rr Rr RR".split(),
-            "yy Yy YY".split(),
-            "oo Oo OO".split(),  # Replaces Y gene for Windflowers.
-            "WW Ww ww".split(),  # 0 is dominant over 2 for W gene.
-            "ss Ss SS".split(),
-        ]
-
-        # Some flowers don't use all genes.
-        for i in Flower.flower_unused_gene[self.type]:
-            del gene_name[i]
-
-        res = []
-        for i, g in enumerate(self.genes):
-            res.append(gene_name[i][g])
-
-        return " ".join(res)
+        species = Flower.species[self.type]
+        return " ".join(species.gene_names(i)[g] for i, g in enumerate(self.genes))
 
     def __add__(self, other) -> List[Tuple["Flower", float]]:
         """
@@ -193,11 +186,16 @@ class Flower:
 FlowerDB = NewType("FlowerDB", Dict[Flower, ColorSeedIsland])
 
 
-def read_code(code: str) -> tuple:
+def read_code(code: str, flower_type: FlowerType) -> tuple:
+    """
+    Genes of a code such as "rr Yy WW ss", gene inversions are given by the species.
+    """
     code = code.replace(" ", "")
+    inverted = Flower.species[flower_type].inverted
+
     def helper(s, l):
         res = sum(1 for c in s if c.isupper())
-        if l == "w":
+        if l in inverted:
             return 2 - res
         return res
 
@@ -208,6 +206,30 @@ def read_code(code: str) -> tuple:
     return tuple(gene_code)
 
 
+def load_species(file: str) -> Dict[FlowerType, Species]:
+    """
+    Reads species definitions (csv file, genes and inverted genes) and registers their
+    flower types in Flower, e.g. "roses" becomes `Flower.ROSES`.
+    """
+    with open(file, "r") as fp:
+        schema = json.load(fp)
+
+    species = {}
+    for name, definition in schema.items():
+        flower_type = FlowerType(f"__{name.upper()}__")
+        species[flower_type] = Species(
+            flower_type=flower_type,
+            file=definition["file"],
+            genes=definition["genes"],
+            inverted=definition.get("inverted", []),
+        )
+        setattr(Flower, name.upper(), flower_type)
+
+    Flower.species = species
+    Flower.flowertypes = list(species)
+    return species
+
+
 def load_flower_info(file_type_couples: List[Tuple[str, FlowerType]]) -> FlowerDB:
     """
     Reads a csv file containing color information about flowers.
@@ -215,11 +237,12 @@ def load_flower_info(file_type_couples: List[Tuple[str, FlowerType]]) -> FlowerD
     d = FlowerDB({})
 
     for file, flower_type in file_type_couples:
+        n_flowers = len(d)
         with open(path.join("data", file), "r") as fp:
             for line in fp.readlines():
                 _, gene, *_, color_info = line.strip().split(",")
 
-                gene_code = read_code(gene)
+                gene_code = read_code(gene, flower_type)
 
                 c = FlowerColor(color_info.split()[0])
                 is_seed = (
@@ -238,23 +261,20 @@ def load_flower_info(file_type_couples: List[Tuple[str, FlowerType]]) -> FlowerD
                     d[Flower(flower_type, tuple(gene_code))] = ColorSeedIsland(
                         c, is_seed, is_island
                     )
+                    # Colors only known from data files
+                    if c not in Flower.flowercolors:
+                        Flower.flowercolors.append(c)
+                        setattr(Flower, c.upper(), c)
+
+        Flower.species[flower_type].supported = len(d) > n_flowers
 
     return d
 
 
-flower_info = load_flower_info(
-    [
-        ("cosmos.csv", Flower.COSMOS),
-        ("hyacinths.csv", Flower.HYACINTHS),
-        ("lilies.csv", Flower.LILIES),
-        ("mums.csv", Flower.MUMS),
-        ("pansies.csv", Flower.PANSIES),
-        ("roses.csv", Flower.ROSES),
-        ("tulips.csv", Flower.TULIPS),
-        ("violets.csv", Flower.VIOLETS),
-        ("windflowers.csv", Flower.WINDFLOWERS),
-    ]
-)
+load_species(path.join("data", "species.json"))
+
+
+flower_info = load_flower_info([(s.file, t) for t, s in Flower.species.items()])
 
 
 @dataclass
@@ -284,6 +304,96 @@ class AncestorInfo:
 FlowerPedia = NewType("FlowerPedia", Dict[Flower, AncestorInfo],)
 
 
+class SpillStore(MutableMapping):
+    """
+    FlowerPedia keeping at most `max_records` AncestorInfo in memory.
+    Least recently used records are spilled to a shelve file `file` and read back when needed.
+
+    A `read_only` store never writes to its file: records not saved yet stay in memory.
+    """
+
+    def __init__(self, file: str, max_records: int = 1024):
+        assert max_records > 0, f"Expected at least 1 record in memory, got {max_records}."
+        self.max_records = max_records
+        self.peak_records = 0
+        self.read_only = False
+
+        self._shelf = shelve.Shelf(dbm.dumb.open(file, "n"), protocol=pickle.HIGHEST_PROTOCOL)
+        self._flowers: Dict[Flower, None] = {}  # All flowers, in insertion order like a dict
+        self._cache: "OrderedDict[Flower, AncestorInfo]" = OrderedDict()
+        self._unsaved: Set[Flower] = set()
+
+    @staticmethod
+    def _key(f: Flower) -> str:
+        return f"{f.type} {f.genes}"
+
+    def _remember(self, f: Flower, info: AncestorInfo):
+        self._cache[f] = info
+        self._cache.move_to_end(f)
+
+        while len(self._cache) > self.max_records:
+            old_f = next(
+                (g for g in self._cache if not (self.read_only and g in self._unsaved)), None
+            )
+            if old_f is None:
+                break  # Only records not saved yet, which cannot be written.
+
+            old_info = self._cache.pop(old_f)
+            if old_f in self._unsaved:
+                self._shelf[self._key(old_f)] = old_info
+                self._unsaved.remove(old_f)
+
+        self.peak_records = max(self.peak_records, len(self._cache))
+
+    def __getitem__(self, f: Flower) -> AncestorInfo:
+        if f in self._cache:
+            self._cache.move_to_end(f)
+            return self._cache[f]
+        if f not in self._flowers:
+            raise KeyError(f)
+
+        info = self._shelf[self._key(f)]
+        self._remember(f, info)
+        return info
+
+    def __setitem__(self, f: Flower, info: AncestorInfo):
+        assert not self.read_only, "Cannot modify a read only store."
+        self._flowers[f] = None
+        self._unsaved.add(f)
+        self._remember(f, info)
+
+    def __delitem__(self, f: Flower):
+        assert not self.read_only, "Cannot modify a read only store."
+        del self._flowers[f]
+        self._cache.pop(f, None)
+        self._unsaved.discard(f)
+        if self._key(f) in self._shelf:
+            del self._shelf[self._key(f)]
+
+    def __contains__(self, f) -> bool:
+        return f in self._flowers
+
+    def __iter__(self) -> Iterator[Flower]:
+        return iter(self._flowers)
+
+    def __len__(self) -> int:
+        return len(self._flowers)
+
+    def close(self):
+        self._shelf.close()
+
+
+def peak_memory() -> Optional[int]:
+    """
+    Peak resident memory of the process in bytes, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
 def universal_get(
     flower_info: FlowerDB,
     _type: Optional[FlowerType] = None,
@@ -323,8 +433,18 @@ def universal_get(
 uget = universal_get
 
 
+T = TypeVar("T")
+
+
+def ordered(items: Iterable[T], deterministic: bool) -> Iterable[T]:
+    """
+    Sorted `items` in deterministic mode. Otherwise as is: set order may change between runs.
+    """
+    return sorted(items) if deterministic else items
+
+
 def prob_test_hybrid(
-    f1: Flower, f2: Flower, f_h: Flower, known_flowers: Set[Flower]
+    f1: Flower, f2: Flower, f_h: Flower, known_flowers: Set[Flower], deterministic: bool = False
 ) -> HybridTestInfo:
     f12 = f1 + f2
     assert f_h in (f[0] for f in f12), f"Flower {f_h} is not an hybrid of {f1} + {f2}."
@@ -347,7 +467,7 @@ def prob_test_hybrid(
     best_color = None
 
     # Try to hybrid new flower with old (known_flowers).
-    for other_f in known_flowers:
+    for other_f in ordered(known_flowers, deterministic):
         h_colors = {f.color for f, p in f_h + other_f}
 
         concurrent_colors = {
@@ -362,7 +482,7 @@ def prob_test_hybrid(
 
         if len(possible_test_colors) > 0:
             # There is some color that we can use.
-            for test_color in possible_test_colors:
+            for test_color in ordered(possible_test_colors, deterministic):
                 p_color = sum(p for f, p in f_h + other_f if f.color == test_color)
 
                 if p_color > best_p_color:
@@ -380,7 +500,7 @@ def prob_test_hybrid(
         )
 
         if len(possible_test_colors) > 0:
-            for test_color in possible_test_colors:
+            for test_color in ordered(possible_test_colors, deterministic):
                 p_color = sum(p for f, p in f_h + f_h if f.color == test_color)
 
                 if p_color > best_p_color:
@@ -401,27 +521,126 @@ o(f OK & f test)    = o(f color ok) * o(f ok | f color OK) * o(f_test color | f
 """
 
 
-def explore(base_flowers: List[Flower]) -> FlowerPedia:
+def hybridize(
+    f1: Flower,
+    f2: Flower,
+    flowerpedia: FlowerPedia,
+    best: Mapping[Flower, AncestorInfo],
+    deterministic: bool = False,
+) -> List[Tuple[Flower, AncestorInfo]]:
     """
-    Compute best path to obtain each flower using only `base_flowers`
+    Hybrids of `f1` and `f2` (both in `flowerpedia`) that improve on best known way
+    to obtain them, given by `best`.
     """
-    flowerpedia = FlowerPedia(
-        {
-            f: AncestorInfo(
-                parents=None,
-                ancestors=set(),
-                test=HybridTestInfo(None, None, 1, None),
-                micro_prob=1.0,
-                no_test_global_prob=1.0,
-            )
-            for f in base_flowers
-        }
+    dp_f1 = flowerpedia[f1]
+    dp_f2 = flowerpedia[f2]
+
+    # Compute unique flowers needed to produce f1 and f2
+    pred_common = dp_f1.ancestors & dp_f2.ancestors
+    prob_common = (
+        dp_f1.total_prob
+        * dp_f2.total_prob
+        / reduce(
+            mul,
+            (
+                flowerpedia[fi].micro_prob * flowerpedia[fi].test.test_prob
+                for fi in ordered(pred_common, deterministic)
+            ),
+            1.0,
+        )  # All flower in pred_common are counter twice in `prob_f1 * prob_f2`
+        # We must divide by `product(prob(i) for i in pred_common)`
     )
 
-    flower_l = base_flowers.copy()
+    res = []
+    for f, p in f1 + f2:
+        if f in (f1, f2):
+            continue
+        if f in best and prob_common < best[f].total_prob:
+            continue
+
+        h_ancestors = dp_f1.ancestors | dp_f2.ancestors | {f1, f2}
+
+        test_result = prob_test_hybrid(f1, f2, f, h_ancestors, deterministic)
+
+        prob_f = prob_common * p * test_result.test_prob
+        if prob_f > 0:
+            # We want to maximize overall total probability of obtaining flower f.
+            if not f in best or best[f].total_prob < prob_f:
+                res.append(
+                    (
+                        f,
+                        AncestorInfo(
+                            parents=(f1, f2),
+                            ancestors=h_ancestors,
+                            test=test_result,
+                            micro_prob=p,
+                            no_test_global_prob=prob_common * p,
+                        ),
+                    )
+                )
+    return res
+
+
+# FlowerPedia of the current pass, inherited by forked workers of `explore`.
+_pass_flowerpedia: Optional[FlowerPedia] = None
+
+
+def explore_pairs(pairs: List[Tuple[Flower, Flower]], deterministic: bool = False) -> List[bool]:
+    """
+    Whether each pair gives hybrids improving on the FlowerPedia of the current pass.
+    """
+    if isinstance(_pass_flowerpedia, SpillStore):
+        # Forked copy of the store: workers must not write to the file of the main process.
+        _pass_flowerpedia.read_only = True
+    return [
+        bool(hybridize(f1, f2, _pass_flowerpedia, _pass_flowerpedia, deterministic))
+        for f1, f2 in pairs
+    ]
+
+
+def explore(
+    base_flowers: List[Flower],
+    jobs: Optional[int] = None,
+    store: Optional[MutableMapping] = None,
+    deterministic: bool = False,
+) -> FlowerPedia:
+    """
+    Compute best path to obtain each flower using only `base_flowers`
+
+    Results are written in `store` if given (e.g. a SpillStore to bound memory), a dict otherwise.
+
+    In `deterministic` mode, sets are iterated in sorted order so ties between hybrids always
+    resolve the same way, whatever the run, the store or the number of jobs.
+
+    With `jobs` > 1, worker processes first find pairs that improve on the FlowerPedia as it
+    was at the beginning of the pass. Pairs are then applied in sequential order, only those
+    found by workers or whose flowers were updated earlier in the pass are evaluated again.
+    Workers are forked so that they iterate over sets in the same order, the FlowerPedia is
+    the same as the sequential one.
+    """
+    global _pass_flowerpedia
+
+    flowerpedia = FlowerPedia({}) if store is None else store
+    for f in base_flowers:
+        flowerpedia[f] = AncestorInfo(
+            parents=None,
+            ancestors=set(),
+            test=HybridTestInfo(None, None, 1, None),
+            micro_prob=1.0,
+            no_test_global_prob=1.0,
+        )
+
     new_flowers = set(base_flowers)
     next_new_flowers: Set[Flower] = set()
 
+    if jobs and jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        warnings.warn("Parallel explore needs to fork processes, running sequentially.")
+        jobs = None
+    if jobs and jobs > 1 and isinstance(store, SpillStore) and not deterministic:
+        # Records read back from disk do not keep the set iteration order workers rely on.
+        warnings.warn("Parallel explore needs an in memory FlowerPedia, running sequentially.")
+        jobs = None
+
     # Floyd Warshall algorithm with no negative cycles
     # Stop when no modification are made to the FlowerPedia
 
@@ -432,52 +651,54 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
         i += 1
         modified = False
 
-        for f1 in flowerpedia.copy():  # Iterate over all flowers seen so far
-            dp_f1 = flowerpedia[f1]
-            for f2 in new_flowers:
-                if f1 in new_flowers and f1 > f2:
-                    continue
-                dp_f2 = flowerpedia[f2]
-
-                # Compute unique flowers needed to produce f1 and f2
-                pred_common = dp_f1.ancestors & dp_f2.ancestors
-                prob_common = (
-                    dp_f1.total_prob
-                    * dp_f2.total_prob
-                    / reduce(
-                        mul,
-                        (
-                            flowerpedia[fi].micro_prob * flowerpedia[fi].test.test_prob
-                            for fi in pred_common
-                        ),
-                        1.0,
-                    )  # All flower in pred_common are counter twice in `prob_f1 * prob_f2`
-                    # We must divide by `product(prob(i) for i in pred_common)`
+        # Flowers seen so far, keys are copied as hybrids are added during the pass.
+        f1_flowers = list(flowerpedia)
+        f2_flowers = list(ordered(new_flowers, deterministic))
+        pairs: Iterable[Tuple[Flower, Flower]] = (
+            (f1, f2)
+            for f1 in f1_flowers
+            for f2 in f2_flowers
+            if not (f1 in new_flowers and f1 > f2)
+        )
+
+        improving: Iterable[bool] = it.repeat(True)
+        if jobs and jobs > 1:
+            pairs = list(pairs)
+            chunk = max(1, math.ceil(len(pairs) / jobs))
+            chunks = [pairs[k : k + chunk] for k in range(0, len(pairs), chunk)]
+            _pass_flowerpedia = flowerpedia
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+                ) as executor:
+                    improving = list(
+                        it.chain.from_iterable(
+                            executor.map(explore_pairs, chunks, [deterministic] * len(chunks))
+                        )
+                    )
+            finally:
+                _pass_flowerpedia = None
+
+        for (f1, f2), improves in zip(pairs, improving):
+            # Flowers updated during this pass (next_new_flowers) may make any pair improving.
+            if not improves and not (
+                next_new_flowers
+                and (
+                    f1 in next_new_flowers
+                    or f2 in next_new_flowers
+                    or not next_new_flowers.isdisjoint(
+                        flowerpedia[f1].ancestors & flowerpedia[f2].ancestors
+                    )
                 )
+            ):
+                continue
 
-                for f, p in f1 + f2:
-                    if f in (f1, f2):
-                        continue
-                    if f in flowerpedia and prob_common < flowerpedia[f].total_prob:
-                        continue
-
-                    h_ancestors = dp_f1.ancestors | dp_f2.ancestors | {f1, f2}
-
-                    test_result = prob_test_hybrid(f1, f2, f, h_ancestors)
-
-                    prob_f = prob_common * p * test_result.test_prob
-                    if prob_f > 0:
-                        # We want to maximize overall total probability of obtaining flower f.
-                        if not f in flowerpedia or flowerpedia[f].total_prob < prob_f:
-                            flowerpedia[f] = AncestorInfo(
-                                parents=(f1, f2),
-                                ancestors=h_ancestors,
-                                test=test_result,
-                                micro_prob=p,
-                                no_test_global_prob=prob_common * p,
-                            )
-                            modified = True
-                            next_new_flowers.add(f)
+            hybrids = hybridize(f1, f2, flowerpedia, flowerpedia, deterministic)
+            for f, info in hybrids:
+                if not f in flowerpedia or flowerpedia[f].total_prob < info.total_prob:
+                    flowerpedia[f] = info
+                    modified = True
+                    next_new_flowers.add(f)
 
         # All flowers will be mixed with all updates flowers during next iteration of algorithm.
         new_flowers = next_new_flowers
@@ -485,122 +706,248 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
     return flowerpedia
 
 
-def ancestors(
-    tgt: Flower, flowerpedia: FlowerPedia, mem: Dict[Flower, Dict] = None
-) -> Dict[str, Any]:
+@dataclass
+class PlanStep:
+    flower: Flower
+    parents: Tuple[Flower, ...]  # 0 (base flower), 1 (self hybrid) or 2 flowers
+    prob: float
+    total_prob: float
+    test: Optional[HybridTestInfo]
+
+
+@dataclass
+class Plan:
+    target: Flower
+    steps: List[PlanStep]
+    names: Dict[str, str]
+
+    def tree(self) -> Dict[str, Any]:
+        """
+        Nested view of the plan: each node holds its code, color and parents `A` and `B`.
+        Shared sub-trees are the same dict objects.
+        """
+        nodes: Dict[Flower, Dict[str, Any]] = {}
+
+        for step in self.steps:
+            f = step.flower
+            if not step.parents:
+                nodes[f] = {"color": f.color, "code": f.code}
+                continue
+
+            test = step.test
+            nodes[f] = {
+                "code": f.code,
+                "A": nodes[step.parents[0]],
+                "B": nodes[step.parents[1]] if len(step.parents) > 1 else None,
+                "prob": f"{step.prob:.03}",
+                "total_prob": f"{step.total_prob:.03}",
+                "color": f.color,
+                "test": {
+                    "unknown_flower_code": test.unknown_flower.code,
+                    "unknown_flower_color": test.unknown_flower.color,
+                    "test_flower_code": test.test_flower.code,
+                    "test_flower_color": test.test_flower.color,
+                    "test_prob": test.test_prob,
+                    "test_color": test.test_color,
+                } if test else None,
+            }
+
+        return nodes[self.target]
+
+
+def extract_plan(tgt: Flower, flowerpedia: FlowerPedia) -> Plan:
     """
-    Determines best way to obtain Flower `tgt` given a `flowerpedia`
-    Recursively get ancestors of `tgt`in the FlowerPedia and aggregate results.
+    Determines best way to obtain Flower `tgt` given a `flowerpedia`.
+    Walks parents links of `tgt` in postfix order (parent A, then parent B, then flower),
+    each flower appearing only once.
     """
-    if mem is None:
-        mem = {}
-    # Memoization for speedup
-    if tgt in mem:
-        return mem[tgt]
+    steps: List[PlanStep] = []
+    names: Dict[str, str] = {}
+    n_colors: Counter = Counter()
+
+    def name(f: Flower):
+        code = f.code
+        if code not in names:
+            names[code] = f"{f.color}_{n_colors[f.color]}"
+            n_colors[f.color] += 1
+
+    done: Set[Flower] = set()
+    pending: Set[Flower] = set()
+    stack = [tgt]
+
+    while stack:
+        f = stack[-1]
+        if f in done:
+            stack.pop()
+            continue
+
+        info = flowerpedia[f]
+        parents = () if info.parents is None else tuple(dict.fromkeys(info.parents))
+
+        if f not in pending:
+            # First visit: parents must be done before the flower itself.
+            pending.add(f)
+            todo = [p for p in parents if p not in done and p not in pending]
+            if todo:
+                stack.extend(reversed(todo))
+                continue
+
+        stack.pop()
+        done.add(f)
+
+        test = info.test if info.test.test_flower and info.test.unknown_flower else None
+        name(f)
+        if test:
+            name(test.test_flower)
+
+        steps.append(
+            PlanStep(
+                flower=f,
+                parents=parents,
+                prob=info.micro_prob if parents else 1.0,
+                total_prob=info.total_prob,
+                test=test,
+            )
+        )
 
-    tgt_info = flowerpedia[tgt]
+    return Plan(target=tgt, steps=steps, names=names)
 
-    if tgt_info.parents is None:
-        return {"color": tgt.color, "code": tgt.code}
-    else:
-        p1, p2 = tgt_info.parents
-
-        a1 = ancestors(p1, flowerpedia, mem)
-        mem[p1] = a1
-
-        a2 = ancestors(p2, flowerpedia, mem)
-        mem[p2] = a2
-
-        comb_prob = dict(p1 + p2)[tgt]
-        return {
-            "code": tgt.code,
-            "A": a1,
-            "B": a2 if a1 != a2 else None,
-            "prob": f"{comb_prob:.03}",
-            "total_prob": f"{flowerpedia[tgt].total_prob:.03}",
-            "color": tgt.color,
-            "test": {
-                "unknown_flower_code": tgt_info.test.unknown_flower.code,
-                "unknown_flower_color": tgt_info.test.unknown_flower.color,
-                "test_flower_code": tgt_info.test.test_flower.code,
-                "test_flower_color": tgt_info.test.test_flower.color,
-                "test_prob": tgt_info.test.test_prob,
-                "test_color": tgt_info.test.test_color
-                } if tgt_info.test.test_flower and tgt_info.test.unknown_flower else None,
-        }
+
+def ancestors(tgt: Flower, flowerpedia: FlowerPedia) -> Dict[str, Any]:
+    """
+    Determines best way to obtain Flower `tgt` given a `flowerpedia` as a tree of ancestors.
+    """
+    return extract_plan(tgt, flowerpedia).tree()
 
 
-def stepify(tgt_flower: Flower, ancestor_tree: Dict[str, Any]) -> Tuple[List[Any], Dict[Flower, str]]:
+def stepify(tgt: Flower, flowerpedia: FlowerPedia) -> Tuple[List[PlanStep], Dict[str, str]]:
     """
-    Gives an ordered list of steps to obtain root flower of the ancestor tree.
+    Gives an ordered list of steps to obtain flower `tgt`.
     each step is: 
 
-        If this is the first time we make this flower:
-            - Obtained Flower
-            - Flowers needed (their names) -> 0, 1 (self hybrid) or 2
-            - Tests needed (HybridTestInfo)
-        
-        Otherwise no steps needed
-        
+        - Obtained Flower
+        - Flowers needed -> 0, 1 (self hybrid) or 2
+        - Probability of the hybridation
+        - Test needed (HybridTestInfo) or None
+
+    Also gives names of flowers, indexed by their code.
     """
-    res: List[Any] = []
-    names: Dict[Flower, str] = {}
+    plan = extract_plan(tgt, flowerpedia)
+    return plan.steps, plan.names
 
-    def helper_postfix(tree: dict, names_ref: Dict[Flower, str], res_ref: List[Any]):
-        curr_gene = read_code(tree["code"])
-        curr_f = Flower(tgt_flower.type, curr_gene)
-        
-        # Downstream
-        children = [tree[v] for v in ["A", "B"] if v in tree and tree[v]]
 
-        for child in children:
-            helper_postfix(child, names_ref, res_ref)
+flowerpedia_keys: List[Tuple[FlowerType, bool, bool]] = [
+    (t, s, i)
+    for t in Flower.flowertypes
+    for s in [True, False]
+    for i in [True, False]
+    if s or i
+]
 
-        # Upstream
-        
-        # This is a new flower
-        if tree["code"] not in names_ref:
-            n_color = sum(1 for v in names_ref.values() if v.startswith(tree["color"]))
-            names_ref[tree["code"]] = f"{tree['color']}_{n_color}"
-            
-            if "test" in tree and tree["test"] and tree["test"]["test_flower_code"] not in names_ref:
-                n_color = sum(1 for v in names_ref.values() if v.startswith(tree["test"]["test_flower_color"]))
-                names_ref[tree["test"]["test_flower_code"]] = f"{tree['test']['test_flower_color']}_{n_color}"
-            
-            
-            res_ref.append((curr_f,
-                            tuple(Flower(tgt_flower.type, read_code(c["code"])) for c in children),
-                            tree["prob"] if "prob" in tree else 1.,
-                            tree["test"] if "test" in tree else None))
-        
-    helper_postfix(ancestor_tree, names, res)
-    return res, names
+
+def base_flowers_of(flower_type: FlowerType, seed: bool, island: bool) -> List[Flower]:
+    """
+    Flowers available at start: seed and/or island flowers of `flower_type`.
+    """
+    base_flowers = []
+    if seed:
+        base_flowers += uget(flower_info, _type=flower_type, _seed=True, _island=False)
+    if island:
+        base_flowers += uget(flower_info, _type=flower_type, _seed=False, _island=True)
+    return base_flowers
 
 
 def get_flowerpedia_db():
+    """
+    FlowerPedia of each (type, seed, island) configuration, read from `db/flowerpedia_db.pkl`
+    when it exists. Configurations missing from it (e.g. a newly added species) are explored.
+    """
+    db = {}
     if path.isfile("db/flowerpedia_db.pkl"):
         db = pickle.load(open("db/flowerpedia_db.pkl", "rb"))
-        return db
 
-    db = {}
-    for t in Flower.flowertypes:
-        print(t)
-        for s in [True, False]:
-            for i in [True, False]:
-                if not s and not i:
-                    continue
-                
-                base_flowers = []
-                if s:
-                    base_flowers += uget(flower_info, _type=t, _seed=s, _island=False)
-                if i:
-                    base_flowers += uget(flower_info, _type=t, _seed=False, _island=i)
-                    
-                
-                db[(t, s, i)] = explore(base_flowers)
+    for t, s, i in flowerpedia_keys:
+        if (t, s, i) not in db:
+            print(t, s, i)
+            db[(t, s, i)] = explore(base_flowers_of(t, s, i))
     return db
 
 
+@dataclass
+class ReachMatrix:
+    """
+    Precomputed answers for one flower type: for each base flowers configuration (seed, island)
+    and each genotype, best total probability (0. if unreachable) and number of hybridation
+    generations needed (-1 if unreachable). Rows are configurations, columns are genotypes.
+    """
+    flower_type: FlowerType
+    configs: List[Tuple[bool, bool]]
+    flowers: List[Flower]
+    total_prob: array.array
+    depth: array.array
+
+    def __post_init__(self):
+        self._config_idx = {c: i for i, c in enumerate(self.configs)}
+        self._flower_idx = {f: i for i, f in enumerate(self.flowers)}
+
+    def _idx(self, f: Flower, seed: bool, island: bool) -> Optional[int]:
+        if f not in self._flower_idx or (seed, island) not in self._config_idx:
+            return None
+        return self._config_idx[(seed, island)] * len(self.flowers) + self._flower_idx[f]
+
+    def best_prob(self, f: Flower, seed: bool, island: bool) -> float:
+        idx = self._idx(f, seed, island)
+        return 0. if idx is None else self.total_prob[idx]
+
+    def steps_depth(self, f: Flower, seed: bool, island: bool) -> int:
+        idx = self._idx(f, seed, island)
+        return -1 if idx is None else self.depth[idx]
+
+    def reachable(self, f: Flower, seed: bool, island: bool) -> bool:
+        return self.steps_depth(f, seed, island) >= 0
+
+    def colors(self, seed: bool, island: bool) -> Dict[FlowerColor, float]:
+        """
+        Reachable colors and best total probability among flowers of this color.
+        """
+        res: Dict[FlowerColor, float] = {}
+        for f in self.flowers:
+            if self.reachable(f, seed, island):
+                res[f.color] = max(res.get(f.color, 0.), self.best_prob(f, seed, island))
+        return res
+
+
+def reach_matrix(flower_type: FlowerType, db: Dict[Tuple[FlowerType, bool, bool], FlowerPedia]) -> ReachMatrix:
+    configs = [(s, i) for t, s, i in flowerpedia_keys if t == flower_type]
+    flowers = sorted(uget(flower_info, _type=flower_type))
+
+    total_prob = array.array("d", [0.]) * (len(configs) * len(flowers))
+    depth = array.array("b", [-1]) * (len(configs) * len(flowers))
+
+    for c, (s, i) in enumerate(configs):
+        flowerpedia = db[(flower_type, s, i)]
+
+        # Generations needed, filled in postfix order of plans so parents are always known.
+        depth_of: Dict[Flower, int] = {}
+        for f in flowerpedia:
+            if f in depth_of:
+                continue
+            for step in extract_plan(f, flowerpedia).steps:
+                if step.flower not in depth_of:
+                    depth_of[step.flower] = 1 + max((depth_of[p] for p in step.parents), default=-1)
+
+        for j, f in enumerate(flowers):
+            if f in flowerpedia:
+                total_prob[c * len(flowers) + j] = flowerpedia[f].total_prob
+                depth[c * len(flowers) + j] = depth_of[f]
+
+    return ReachMatrix(flower_type, configs, flowers, total_prob, depth)
+
+
+def get_reach_db(db: Dict[Tuple[FlowerType, bool, bool], FlowerPedia]) -> Dict[FlowerType, ReachMatrix]:
+    return {t: reach_matrix(t, db) for t in Flower.flowertypes}
+
+
 def cli():
     parser = argparse.ArgumentParser()
 
@@ -644,6 +991,31 @@ def cli():
         default=False,
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes used to explore hybrids",
+    )
+
+    parser.add_argument(
+        "--spill",
+        default=None,
+        help="File where records of explored flowers are spilled to bound memory",
+    )
+    parser.add_argument(
+        "--max-records",
+        type=int,
+        default=1024,
+        help="Maximum number of records kept in memory when spilling",
+    )
+    parser.add_argument(
+        "--deterministic",
+        action="store_true",
+        help="Break ties between hybrids the same way on every run",
+    )
+
     args = parser.parse_args()
 
     print(args)
@@ -667,7 +1039,7 @@ def cli():
 
     # print(f"{args=}")
     # print(f"{tgt_flowers=}")
-    return base_flowers, tgt_flowers
+    return base_flowers, tgt_flowers, args
 
 
 def main():
@@ -684,15 +1056,23 @@ def main():
 
     # ---
 
-    base, tgt = cli()
-    flowerpedia = explore(base)
+    base, tgt, args = cli()
+    store = SpillStore(args.spill, args.max_records) if args.spill else None
+    flowerpedia = explore(base, args.jobs, store, args.deterministic)
     
     for t in tgt:
         print(t, t in flowerpedia)
     
     max_tgt = max(tgt, key=lambda x: flowerpedia[x].total_prob if x in flowerpedia else -math.inf)
-    pprint(a := ancestors(max_tgt, flowerpedia))
-    pprint(stepify(max_tgt, a))
+    plan = extract_plan(max_tgt, flowerpedia)
+    pprint(plan.tree())
+    pprint((plan.steps, plan.names))
+
+    if store is not None:
+        print(f"Peak records in memory: {store.peak_records}/{len(store)}")
+        store.close()
+    if (peak := peak_memory()) is not None:
+        print(f"Peak memory: {peak / 2 ** 20:.1f} MiB")
 
     # ---
     